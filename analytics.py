@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Offline-Auswertung der gespeicherten Konversationen
+
+Liest alle Konversationsdateien aus DATA_DIR dateiweise über einen Prozesspool
+ein und schreibt Nutzungsstatistiken als CSV-Tabellen (eine Datei pro Kennzahl):
+aktive Benutzer, Nachrichten pro Tag, Modalitäten, geschätzte Token-Nutzung und
+Kosten pro Modell sowie die häufigsten Fragen und Themen.
+
+Verwendung:
+    python analytics.py --output ./analytics_out
+    python analytics.py --data-dir ./data --workers 8 --top 100
+    python analytics.py --include-archive
+"""
+
+import os
+import re
+import csv
+import json
+import logging
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta, timezone
+from itertools import chain
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from conversation_lifecycle import ConversationLifecycleManager, read_archive_record
+from prompt_layout import (
+    CHAT_MODEL,
+    PROMPT_LAYOUT,
+    PROMPT_LAYOUTS,
+    SUMMARY_MAX_QUESTIONS,
+    SUMMARY_QUESTION_CHARS,
+    history_window_start,
+)
+
+# Konfiguration des Loggings
+logging.basicConfig(
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    level=logging.INFO,
+    encoding='utf-8'
+)
+logger = logging.getLogger(__name__)
+
+# Laden der Umgebungsvariablen
+load_dotenv()
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "./data"))
+
+# Preise in USD pro 1 Mio. Token (Eingabe, Ausgabe)
+MODEL_PRICING = {
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-3.5-turbo-0125": (0.50, 1.50),
+}
+
+# Grobe Schätzung: ca. 4 Zeichen pro Token, ein Bild ca. 765 Token (detail=high, 1024px)
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 765
+
+# Token für die Überschrift der Verlaufszusammenfassung im stabilen Anfrageaufbau
+SUMMARY_HEADER_TOKENS = 10
+
+# Dateien pro Aufgabe an einen Worker und maximal offene Aufgaben pro Worker
+CHUNK_SIZE = 500
+MAX_PENDING_PER_WORKER = 4
+
+# Pro Teilergebnis behaltene Fragen, damit der Speicher begrenzt bleibt.
+# Die Rangliste der häufigsten Fragen ist dadurch eine (sehr gute) Näherung.
+QUESTION_KEEP = 5000
+
+STOPWORDS = frozenset("""
+aber alle allem allen aller alles als also am an ander andere anderen auch auf aus
+bei bin bis bist da damit dann das dass dein deine dem den der des dich die dir
+doch dort du durch ein eine einem einen einer eines er es etwas euch euer für gegen
+gibt hab habe haben hat hatte hier hin hinter ich ihm ihn ihnen ihr ihre im in ist
+ja jede jeden jeder jetzt kann kannst kein keine können könnte man mehr mein meine
+mich mir mit muss nach nicht nichts noch nun nur ob oder ohne sehr sein seine sich
+sie sind so soll sollte sondern über um und uns unser unter viel vom von vor war
+was weil welche welchen wenn wer werde werden wie wir wird wo zu zum zur zwischen
+bitte danke hallo gerne
+""".split())
+
+WORD_RE = re.compile(r"[a-zäöüß]{3,}")
+
+
+def iter_conversation_files(data_dir: Path) -> Iterator[str]:
+    """Liefert die Pfade aller Konversationsdateien, ohne das Verzeichnis komplett einzulesen."""
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.endswith(".json"):
+                yield entry.path
+
+
+def iter_archive_chunks(data_dir: Path, chunk_size: int) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+    """Liefert (Archivpfad, [(Offset, Länge), ...]) für alle archivierten Konversationen."""
+    manager = ConversationLifecycleManager(data_dir)
+    hot_files = {os.path.basename(path) for path in iter_conversation_files(data_dir)}
+    by_archive = defaultdict(list)
+    for user_id, entry in manager.load_index().items():
+        # Wiederhergestellte Konversationen werden bereits als aktive Datei gezählt,
+        # abgelaufene nicht mehr ausgewertet
+        if f"{user_id}.json" in hot_files or manager.is_expired(entry):
+            continue
+        by_archive[entry["archive"]].append((entry["offset"], entry["length"]))
+    for name, entries in by_archive.items():
+        entries.sort()
+        for chunk in chunked(entries, chunk_size):
+            yield str(manager.archive_dir / name), chunk
+
+
+def chunked(items: Iterable, size: int) -> Iterator[list]:
+    """Teilt einen Iterator in Listen fester Größe auf."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def estimate_tokens(content) -> int:
+    """Schätzt die Tokenanzahl eines Nachrichteninhalts (Text oder Liste von Teilen)."""
+    if isinstance(content, str):
+        return max(1, len(content) // CHARS_PER_TOKEN) if content else 0
+    if isinstance(content, list):
+        tokens = 0
+        for part in content:
+            if not isinstance(part, dict):
+                continue
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS
+            else:
+                tokens += estimate_tokens(part.get("text", ""))
+        return tokens
+    return 0
+
+
+def message_text(content) -> str:
+    """Extrahiert den Textanteil eines Nachrichteninhalts."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(
+            part.get("text", "") for part in content
+            if isinstance(part, dict) and part.get("type") == "text"
+        )
+    return ""
+
+
+def message_modality(message: dict) -> str:
+    """Bestimmt die Modalität einer Nachricht (text, image oder audio)."""
+    msg_type = message.get("type")
+    if msg_type in ("voice", "audio"):
+        return "audio"
+    if msg_type in ("photo", "image"):
+        return "image"
+    content = message.get("content")
+    if isinstance(content, list) and any(
+        isinstance(part, dict) and part.get("type") == "image_url" for part in content
+    ):
+        return "image"
+    return "text"
+
+
+def message_role(message: dict) -> Optional[str]:
+    """Vereinheitlicht die Rolle für beide Speicherformate (role bzw. is_bot)."""
+    if "role" in message:
+        return message["role"]
+    if "is_bot" in message:
+        return "assistant" if message["is_bot"] else "user"
+    return "user" if message.get("content") else None
+
+
+def message_day(message: dict) -> Optional[str]:
+    """Liefert das Datum einer Nachricht oder None, wenn kein Zeitstempel gespeichert ist."""
+    timestamp = message.get("timestamp")
+    if isinstance(timestamp, (int, float)):
+        return datetime.fromtimestamp(timestamp, tz=timezone.utc).date().isoformat()
+    if isinstance(timestamp, str) and len(timestamp) >= 10:
+        return timestamp[:10]
+    return None
+
+
+def normalize_question(text: str) -> str:
+    """Normalisiert eine Benutzerfrage für die Häufigkeitszählung."""
+    return " ".join(text.lower().split())[:200]
+
+
+def new_stats() -> dict:
+    """Erzeugt ein leeres, zusammenführbares Teilergebnis."""
+    return {
+        "users": 0,
+        "active_users": 0,
+        "recent_users": 0,
+        "files_failed": 0,
+        "messages": 0,
+        "messages_without_timestamp": 0,
+        "messages_per_day": Counter(),
+        "active_users_per_day": Counter(),
+        "modality": Counter(),
+        "model_requests": Counter(),
+        "model_prompt_tokens": Counter(),
+        "model_completion_tokens": Counter(),
+        "questions": Counter(),
+        "keywords": Counter(),
+    }
+
+
+def merge_stats(total: dict, part: dict):
+    """Führt ein Teilergebnis in das Gesamtergebnis zusammen."""
+    for key, value in part.items():
+        total[key] += value
+    if len(total["questions"]) > 2 * QUESTION_KEEP:
+        total["questions"] = Counter(dict(total["questions"].most_common(QUESTION_KEEP)))
+
+
+def estimate_prompt_tokens(
+    system_tokens: int, history: List[Tuple[str, int, int]], current: Tuple[int, int], layout: str
+) -> int:
+    """
+    Schätzt die Prompt-Token einer Anfrage so, wie process_message sie aufbaut.
+
+    history enthält (Rolle, Texttoken, Fragetoken) der Nachrichten vor der aktuellen,
+    current (Texttoken, Token inkl. Bild) der aktuellen Nachricht.
+    """
+    current_text_tokens, current_tokens = current
+    if layout != "stable":
+        # Der Verlauf aus ConversationManager ist leer, gesendet wird nur der Nachrichtentext
+        return system_tokens + current_text_tokens
+
+    start = history_window_start(len(history))
+    questions = [
+        question_tokens for role, _, question_tokens in history[:start]
+        if role == "user" and question_tokens
+    ][-SUMMARY_MAX_QUESTIONS:]
+    summary_tokens = SUMMARY_HEADER_TOKENS + sum(questions) if questions else 0
+    window_tokens = sum(text_tokens for _, text_tokens, _ in history[start:])
+    return system_tokens + summary_tokens + window_tokens + current_tokens
+
+
+def analyze_conversation(messages: list, stats: dict, layout: str) -> bool:
+    """Wertet die Nachrichten eines Benutzers aus. Gibt zurück, ob der Benutzer aktiv war."""
+    system_tokens = 0
+    history = []
+    current = None
+    active = False
+    active_days = set()
+
+    for message in messages:
+        if not isinstance(message, dict):
+            continue
+        role = message_role(message)
+        content = message.get("content", "")
+
+        if role == "system":
+            system_tokens = estimate_tokens(content)
+            continue
+        if role not in ("user", "assistant"):
+            continue
+
+        stats["messages"] += 1
+        day = message_day(message)
+        if day is None:
+            stats["messages_without_timestamp"] += 1
+        else:
+            stats["messages_per_day"][day] += 1
+
+        text = message_text(content)
+        text_tokens = estimate_tokens(text)
+
+        if role == "user":
+            active = True
+            if day is not None:
+                active_days.add(day)
+            stats["modality"][message_modality(message)] += 1
+            if text:
+                stats["questions"][normalize_question(text)] += 1
+                stats["keywords"].update(
+                    word for word in WORD_RE.findall(text.lower()) if word not in STOPWORDS
+                )
+            # Unbeantwortete Benutzernachricht (z.B. nach einem Fehler) wandert in den Verlauf
+            if current is not None:
+                history.append(current[:3])
+            current = ("user", text_tokens, estimate_tokens(text[:SUMMARY_QUESTION_CHARS]), estimate_tokens(content))
+            continue
+
+        # Nur Antworten auf eine Benutzernachricht entsprechen einer API-Anfrage
+        # (die Begrüßung von /start wird ohne Anfrage gespeichert)
+        if current is not None:
+            # Ältere Antworten ohne gespeichertes Modell stammen vom aktuellen Chat-Modell
+            model = message.get("model", CHAT_MODEL)
+            stats["model_requests"][model] += 1
+            stats["model_prompt_tokens"][model] += estimate_prompt_tokens(
+                system_tokens, history, (current[1], current[3]), layout
+            )
+            stats["model_completion_tokens"][model] += text_tokens
+            history.append(current[:3])
+            current = None
+        history.append(("assistant", text_tokens, 0))
+
+    for day in active_days:
+        stats["active_users_per_day"][day] += 1
+    return active
+
+
+def analyze_user(messages, last_active: float, stats: dict, layout: str, recent_since: float):
+    """Zählt einen Benutzer samt Konversation in das Teilergebnis ein."""
+    if not isinstance(messages, list):
+        stats["files_failed"] += 1
+        return
+    stats["users"] += 1
+    if analyze_conversation(messages, stats, layout):
+        stats["active_users"] += 1
+        if last_active >= recent_since:
+            stats["recent_users"] += 1
+
+
+def analyze_user_safely(
+    source: str, messages, last_active: float, stats: dict, layout: str, recent_since: float
+):
+    """Wertet einen Benutzer aus; eine fehlerhafte Konversation wird gezählt und übersprungen."""
+    user_stats = new_stats()
+    try:
+        analyze_user(messages, last_active, user_stats, layout, recent_since)
+    except Exception as e:
+        logger.warning(f"Konversation {source} konnte nicht ausgewertet werden: {e}")
+        stats["files_failed"] += 1
+        return
+    merge_stats(stats, user_stats)
+
+
+def analyze_chunk(paths: List[str], layout: str, recent_since: float) -> dict:
+    """Wertet eine Gruppe von Konversationsdateien aus (läuft im Worker-Prozess)."""
+    stats = new_stats()
+    for path in paths:
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "r", encoding="utf-8") as file:
+                messages = json.load(file)
+        except Exception as e:
+            logger.warning(f"Datei {path} konnte nicht gelesen werden: {e}")
+            stats["files_failed"] += 1
+            continue
+        analyze_user_safely(path, messages, mtime, stats, layout, recent_since)
+
+    stats["questions"] = Counter(dict(stats["questions"].most_common(QUESTION_KEEP)))
+    return stats
+
+
+def analyze_archive_chunk(
+    archive_path: str, entries: List[Tuple[int, int]], layout: str, recent_since: float
+) -> dict:
+    """Wertet archivierte Konversationen aus einem Monatsarchiv aus (läuft im Worker-Prozess)."""
+    stats = new_stats()
+    try:
+        file = open(archive_path, "rb")
+    except Exception as e:
+        logger.warning(f"Archiv {archive_path} konnte nicht geöffnet werden: {e}")
+        stats["files_failed"] += len(entries)
+        return stats
+    with file:
+        for offset, length in entries:
+            try:
+                record = read_archive_record(file, offset, length)
+                last_active = datetime.fromisoformat(record["last_active"]).timestamp()
+                messages = record["messages"]
+            except Exception as e:
+                logger.warning(f"Eintrag bei Offset {offset} in {archive_path} ist fehlerhaft: {e}")
+                stats["files_failed"] += 1
+                continue
+            analyze_user_safely(
+                f"{archive_path}@{offset}", messages, last_active, stats, layout, recent_since
+            )
+
+    stats["questions"] = Counter(dict(stats["questions"].most_common(QUESTION_KEEP)))
+    return stats
+
+
+def run_analysis(
+    data_dir: Path,
+    workers: Optional[int] = None,
+    layout: str = PROMPT_LAYOUT,
+    recent_days: int = 30,
+    chunk_size: int = CHUNK_SIZE,
+    include_archive: bool = False,
+) -> dict:
+    """Verteilt die Konversationsdateien auf einen Prozesspool und führt die Ergebnisse zusammen."""
+    workers = workers or os.cpu_count() or 1
+    recent_since = (datetime.now(timezone.utc) - timedelta(days=recent_days)).timestamp()
+    max_pending = workers * MAX_PENDING_PER_WORKER
+    total = new_stats()
+
+    tasks = (
+        (analyze_chunk, chunk)
+        for chunk in chunked(iter_conversation_files(data_dir), chunk_size)
+    )
+    if include_archive:
+        tasks = chain(tasks, (
+            (analyze_archive_chunk, archive_path, entries)
+            for archive_path, entries in iter_archive_chunks(data_dir, chunk_size)
+        ))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for func, *args in tasks:
+            # Nur begrenzt viele Aufgaben gleichzeitig einreihen, damit der Speicher konstant bleibt
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    merge_stats(total, future.result())
+            pending.add(executor.submit(func, *args, layout, recent_since))
+        for future in pending:
+            merge_stats(total, future.result())
+
+    logger.info(
+        f"{total['users']} Konversationen ausgewertet, {total['files_failed']} fehlerhaft."
+    )
+    return total
+
+
+def model_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Berechnet die geschätzten Kosten in USD oder None, wenn der Preis unbekannt ist."""
+    pricing = MODEL_PRICING.get(model)
+    if pricing is None:
+        return None
+    input_price, output_price = pricing
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+def write_csv(path: Path, header: List[str], rows: Iterable[list]):
+    """Schreibt eine Tabelle als CSV-Datei."""
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def write_results(stats: dict, output_dir: Path, top: int, recent_days: int):
+    """Schreibt alle Kennzahlen als einzelne CSV-Tabellen in das Ausgabeverzeichnis."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    model_rows = []
+    total_cost = 0.0
+    for model, requests in sorted(stats["model_requests"].items()):
+        prompt_tokens = stats["model_prompt_tokens"][model]
+        completion_tokens = stats["model_completion_tokens"][model]
+        cost = model_cost(model, prompt_tokens, completion_tokens)
+        total_cost += cost or 0.0
+        model_rows.append([
+            model, requests, prompt_tokens, completion_tokens,
+            "" if cost is None else f"{cost:.4f}",
+        ])
+
+    write_csv(output_dir / "summary.csv", ["metric", "value"], [
+        ["users", stats["users"]],
+        ["active_users", stats["active_users"]],
+        [f"active_users_last_{recent_days}_days", stats["recent_users"]],
+        ["messages", stats["messages"]],
+        ["messages_without_timestamp", stats["messages_without_timestamp"]],
+        ["files_failed", stats["files_failed"]],
+        ["estimated_cost_usd", f"{total_cost:.4f}"],
+    ])
+    write_csv(
+        output_dir / "messages_per_day.csv",
+        ["date", "messages", "active_users"],
+        (
+            [day, stats["messages_per_day"][day], stats["active_users_per_day"][day]]
+            for day in sorted(stats["messages_per_day"])
+        ),
+    )
+    write_csv(
+        output_dir / "modality.csv",
+        ["modality", "messages"],
+        stats["modality"].most_common(),
+    )
+    write_csv(
+        output_dir / "model_usage.csv",
+        ["model", "requests", "prompt_tokens", "completion_tokens", "cost_usd"],
+        model_rows,
+    )
+    write_csv(
+        output_dir / "top_questions.csv",
+        ["question", "count"],
+        stats["questions"].most_common(top),
+    )
+    write_csv(
+        output_dir / "top_keywords.csv",
+        ["keyword", "count"],
+        stats["keywords"].most_common(top),
+    )
+    logger.info(f"Auswertung nach {output_dir} geschrieben.")
+
+
+def main():
+    """Startet die Auswertung über die Kommandozeile."""
+    parser = argparse.ArgumentParser(
+        description="Nutzungsstatistiken aus den gespeicherten Konversationen erstellen."
+    )
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR,
+                        help="Verzeichnis mit den Konversationsdateien (Standard: DATA_DIR)")
+    parser.add_argument("--output", type=Path, default=Path("./analytics"),
+                        help="Ausgabeverzeichnis für die CSV-Dateien")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Anzahl der Worker-Prozesse (Standard: Anzahl CPUs)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE,
+                        help="Dateien pro Worker-Aufgabe")
+    parser.add_argument("--prompt-layout", choices=PROMPT_LAYOUTS, default=PROMPT_LAYOUT,
+                        help="Anfrageaufbau für die Token-Schätzung (Standard: PROMPT_LAYOUT)")
+    parser.add_argument("--recent-days", type=int, default=30,
+                        help="Zeitraum in Tagen für 'kürzlich aktive' Benutzer")
+    parser.add_argument("--top", type=int, default=50,
+                        help="Anzahl der häufigsten Fragen und Themen")
+    parser.add_argument("--include-archive", action="store_true",
+                        help="Archivierte Konversationen (siehe conversation_lifecycle.py) mit auswerten")
+    args = parser.parse_args()
+
+    if not args.data_dir.is_dir():
+        logger.error(f"Datenverzeichnis {args.data_dir} existiert nicht")
+        return
+
+    stats = run_analysis(
+        args.data_dir,
+        workers=args.workers,
+        layout=args.prompt_layout,
+        recent_days=args.recent_days,
+        chunk_size=args.chunk_size,
+        include_archive=args.include_archive,
+    )
+    write_results(stats, args.output, args.top, args.recent_days)
+
+
+if __name__ == "__main__":
+    main()
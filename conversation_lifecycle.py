@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Lebenszyklus der gespeicherten Konversationen
+
+Konversationen, die länger als ARCHIVE_AFTER_DAYS Tage inaktiv sind, werden aus
+DATA_DIR in gzip-komprimierte Archive verschoben, gebündelt nach dem Monat der
+letzten Aktivität (archive/conversations-JJJJ-MM.jsonl.gz). Jede Konversation ist
+ein eigenes gzip-Mitglied; der Index (archive/index/XX.json, nach Benutzer-ID auf
+INDEX_SHARDS Dateien verteilt) speichert Offset und Länge. So liest der Bot für
+einen zurückkehrenden Benutzer nur eine kleine Indexdatei und ein einzelnes
+gzip-Mitglied, ohne den ganzen Index oder das ganze Archiv zu laden.
+
+Nach RETENTION_DAYS Tagen (siehe privacy_policy.py) werden Konversationen
+endgültig gelöscht. Archive mit abgelaufenen Einträgen werden ohne diese neu
+geschrieben; nicht mehr referenzierte Archive werden entfernt.
+
+Verwendung (z.B. täglich per Cronjob):
+    python conversation_lifecycle.py run
+    python conversation_lifecycle.py restore 123456789
+"""
+
+import os
+import gzip
+import json
+import zlib
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from privacy_policy import RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Laden der Umgebungsvariablen
+load_dotenv()
+
+DATA_DIR = Path(os.getenv("DATA_DIR", "./data"))
+
+# Tage ohne neue Nachricht, nach denen eine Konversation archiviert wird
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "30"))
+
+ARCHIVE_DIR_NAME = "archive"
+INDEX_DIR_NAME = "index"
+INDEX_SHARDS = 256
+BUCKET_PREFIX = "conversations-"
+BUCKET_SUFFIX = ".jsonl.gz"
+
+
+def index_shard(user_id: str) -> str:
+    """Liefert den Namen der Indexdatei, in der der Eintrag eines Benutzers steht."""
+    return f"{zlib.crc32(str(user_id).encode('utf-8')) % INDEX_SHARDS:02x}"
+
+
+def read_archive_record(file, offset: int, length: int) -> dict:
+    """Liest und entpackt ein einzelnes gzip-Mitglied aus einer geöffneten Archivdatei."""
+    file.seek(offset)
+    return json.loads(gzip.decompress(file.read(length)).decode("utf-8"))
+
+
+class ConversationLifecycleManager:
+    """Archiviert inaktive Konversationen, stellt sie wieder her und setzt die Aufbewahrungsfrist durch."""
+
+    def __init__(
+        self,
+        data_dir: Path = DATA_DIR,
+        archive_after_days: int = ARCHIVE_AFTER_DAYS,
+        retention_days: int = RETENTION_DAYS,
+    ):
+        self.data_dir = Path(data_dir)
+        self.archive_dir = self.data_dir / ARCHIVE_DIR_NAME
+        self.index_dir = self.archive_dir / INDEX_DIR_NAME
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self._shard_cache = {}
+
+    @staticmethod
+    def bucket_name(last_active: datetime) -> str:
+        """Liefert den Namen des Monatsarchivs für einen Zeitpunkt der letzten Aktivität."""
+        return f"{BUCKET_PREFIX}{last_active:%Y-%m}{BUCKET_SUFFIX}"
+
+    def is_expired(self, entry: dict, now: Optional[datetime] = None) -> bool:
+        """Prüft, ob die Aufbewahrungsfrist eines Indexeintrags abgelaufen ist."""
+        now = now or datetime.now(timezone.utc)
+        last_active = datetime.fromisoformat(entry["last_active"])
+        return last_active < now - timedelta(days=self.retention_days)
+
+    def _shard_path(self, shard: str) -> Path:
+        """Liefert den Pfad einer Indexdatei."""
+        return self.index_dir / f"{shard}.json"
+
+    def _read_shard(self, shard: str) -> Dict[str, dict]:
+        """Liest eine Indexdatei; eine fehlende Datei entspricht einem leeren Index."""
+        try:
+            with open(self._shard_path(shard), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def load_index(self) -> Dict[str, dict]:
+        """Lädt den vollständigen Archivindex aus allen Indexdateien (für Cronjob und Auswertung)."""
+        index = {}
+        if self.index_dir.is_dir():
+            for path in self.index_dir.glob("*.json"):
+                index.update(self._read_shard(path.stem))
+        return index
+
+    def load_index_entry(self, user_id: str) -> Optional[dict]:
+        """
+        Liefert den Indexeintrag eines Benutzers.
+
+        Liest nur die zugehörige Indexdatei (ca. 1/INDEX_SHARDS des Index) und nur dann
+        neu, wenn sie sich seit dem letzten Zugriff geändert hat. Geeignet für den
+        Aufruf im Bot bei jedem neuen Benutzer.
+        """
+        shard = index_shard(user_id)
+        try:
+            mtime = self._shard_path(shard).stat().st_mtime
+        except FileNotFoundError:
+            self._shard_cache.pop(shard, None)
+            return None
+        cached = self._shard_cache.get(shard)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, self._read_shard(shard))
+            self._shard_cache[shard] = cached
+        return cached[1].get(str(user_id))
+
+    def _save_index(self, index: Dict[str, dict], previous: Dict[str, dict]):
+        """Schreibt die geänderten Indexdateien jeweils atomar; leere werden entfernt."""
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        shards, previous_shards = {}, {}
+        for user_id, entry in index.items():
+            shards.setdefault(index_shard(user_id), {})[user_id] = entry
+        for user_id, entry in previous.items():
+            previous_shards.setdefault(index_shard(user_id), {})[user_id] = entry
+
+        for shard in set(shards) | set(previous_shards):
+            entries = shards.get(shard, {})
+            if entries == previous_shards.get(shard, {}):
+                continue
+            path = self._shard_path(shard)
+            if not entries:
+                path.unlink(missing_ok=True)
+                continue
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(entries, file, ensure_ascii=False, separators=(",", ":"))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, path)
+
+    def archive_inactive(self, now: Optional[datetime] = None) -> int:
+        """Verschiebt inaktive Konversationen in die Monatsarchive. Gibt die Anzahl zurück."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(days=self.archive_after_days)).timestamp()
+        previous = self.load_index()
+        index = dict(previous)
+        archived = []
+        buckets = {}
+
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            with os.scandir(self.data_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.endswith(".json"):
+                        continue
+                    mtime = entry.stat().st_mtime
+                    if mtime >= cutoff:
+                        continue
+                    try:
+                        with open(entry.path, "r", encoding="utf-8") as file:
+                            messages = json.load(file)
+                    except Exception as e:
+                        logger.error(f"Konversation {entry.path} konnte nicht gelesen werden: {e}")
+                        continue
+
+                    user_id = entry.name[:-len(".json")]
+                    last_active = datetime.fromtimestamp(mtime, tz=timezone.utc)
+                    name = self.bucket_name(last_active)
+                    record = json.dumps(
+                        {"user_id": user_id, "last_active": last_active.isoformat(), "messages": messages},
+                        ensure_ascii=False,
+                        separators=(",", ":"),
+                    )
+                    member = gzip.compress(record.encode("utf-8") + b"\n")
+
+                    if name not in buckets:
+                        buckets[name] = open(self.archive_dir / name, "ab")
+                    bucket = buckets[name]
+                    offset = bucket.tell()
+                    bucket.write(member)
+                    index[user_id] = {
+                        "archive": name,
+                        "offset": offset,
+                        "length": len(member),
+                        "last_active": last_active.isoformat(),
+                    }
+                    archived.append((entry.path, mtime))
+        finally:
+            for bucket in buckets.values():
+                bucket.flush()
+                os.fsync(bucket.fileno())
+                bucket.close()
+
+        if not archived:
+            return 0
+
+        # Erst den Index sichern, dann die aktiven Dateien entfernen
+        self._save_index(index, previous)
+        for path, mtime in archived:
+            try:
+                if os.path.getmtime(path) == mtime:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        logger.info(f"{len(archived)} inaktive Konversationen archiviert.")
+        return len(archived)
+
+    def _compact_bucket(self, name: str, entries: Dict[str, dict], now: datetime) -> str:
+        """
+        Schreibt die noch gültigen Einträge eines Archivs in eine neue Archivdatei.
+
+        Die Einträge werden auf die neue Datei umgeschrieben; die alte Datei wird erst
+        entfernt, wenn der Index gespeichert ist und sie nicht mehr referenziert.
+        """
+        month = name[len(BUCKET_PREFIX):len(BUCKET_PREFIX) + len("JJJJ-MM")]
+        new_name = f"{BUCKET_PREFIX}{month}.{now:%Y%m%d%H%M%S}{BUCKET_SUFFIX}"
+        counter = 1
+        while (self.archive_dir / new_name).exists():
+            new_name = f"{BUCKET_PREFIX}{month}.{now:%Y%m%d%H%M%S}-{counter}{BUCKET_SUFFIX}"
+            counter += 1
+
+        with open(self.archive_dir / name, "rb") as source, \
+                open(self.archive_dir / new_name, "wb") as target:
+            for entry in sorted(entries.values(), key=lambda entry: entry["offset"]):
+                source.seek(entry["offset"])
+                member = source.read(entry["length"])
+                entry["offset"] = target.tell()
+                entry["archive"] = new_name
+                target.write(member)
+            target.flush()
+            os.fsync(target.fileno())
+        return new_name
+
+    def enforce_retention(self, now: Optional[datetime] = None) -> int:
+        """Löscht Konversationen, deren Aufbewahrungsfrist abgelaufen ist. Gibt die Anzahl zurück."""
+        now = now or datetime.now(timezone.utc)
+        cutoff = now - timedelta(days=self.retention_days)
+        previous = self.load_index()
+        index = {user_id: dict(entry) for user_id, entry in previous.items()}
+        deleted = 0
+
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(".json"):
+                    continue
+                if entry.stat().st_mtime < cutoff.timestamp():
+                    os.remove(entry.path)
+                    index.pop(entry.name[:-len(".json")], None)
+                    deleted += 1
+
+        # Abgelaufene Einträge einzeln nach ihrer letzten Aktivität entfernen
+        affected = set()
+        for user_id, entry in list(index.items()):
+            if self.is_expired(entry, now):
+                affected.add(entry["archive"])
+                del index[user_id]
+                deleted += 1
+
+        # Archive mit abgelaufenen Einträgen ohne diese neu schreiben
+        for name in affected:
+            live = {user_id: entry for user_id, entry in index.items() if entry["archive"] == name}
+            if live:
+                self._compact_bucket(name, live, now)
+
+        if index != previous:
+            self._save_index(index, previous)
+
+        # Nicht mehr referenzierte Archive entfernen (abgelaufen, verdichtet oder verwaist)
+        if self.archive_dir.is_dir():
+            referenced = {entry["archive"] for entry in index.values()}
+            for path in self.archive_dir.glob(f"{BUCKET_PREFIX}*{BUCKET_SUFFIX}"):
+                if path.name not in referenced:
+                    os.remove(path)
+
+        if deleted:
+            logger.info(f"{deleted} Konversationen nach Ablauf der Aufbewahrungsfrist gelöscht.")
+        return deleted
+
+    def run(self, now: Optional[datetime] = None):
+        """Setzt die Aufbewahrungsfrist durch und archiviert anschließend inaktive Konversationen."""
+        self.enforce_retention(now)
+        self.archive_inactive(now)
+
+    def read_archived(self, user_id: str) -> Optional[list]:
+        """
+        Liest die archivierte Konversation eines Benutzers, ohne sie wiederherzustellen.
+
+        Einträge mit abgelaufener Aufbewahrungsfrist werden nicht mehr herausgegeben,
+        auch wenn die Bereinigung noch nicht gelaufen ist.
+        """
+        entry = self.load_index_entry(str(user_id))
+        if entry is None or self.is_expired(entry):
+            return None
+        with open(self.archive_dir / entry["archive"], "rb") as file:
+            record = read_archive_record(file, entry["offset"], entry["length"])
+        return record["messages"]
+
+    def restore(self, user_id: str) -> Optional[list]:
+        """
+        Stellt die archivierte Konversation eines Benutzers in DATA_DIR wieder her.
+
+        Eine vorhandene aktive Datei hat immer Vorrang; der Indexeintrag bleibt bis zur
+        nächsten Archivierung bestehen und wird dann überschrieben.
+        """
+        file_path = self.data_dir / f"{user_id}.json"
+        if file_path.exists():
+            return None
+        try:
+            messages = self.read_archived(user_id)
+        except Exception as e:
+            logger.error(f"Fehler beim Wiederherstellen der Konversation für Benutzer {user_id}: {e}")
+            return None
+        if messages is None:
+            return None
+
+        with open(file_path, "w", encoding="utf-8") as file:
+            json.dump(messages, file, ensure_ascii=False, indent=2)
+        logger.info(f"Konversation für Benutzer {user_id} aus dem Archiv wiederhergestellt.")
+        return messages
+
+
+def main():
+    """Führt die Lebenszyklus-Aufgaben über die Kommandozeile aus."""
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+        encoding='utf-8'
+    )
+    parser = argparse.ArgumentParser(
+        description="Inaktive Konversationen archivieren und die Aufbewahrungsfrist durchsetzen."
+    )
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR,
+                        help="Verzeichnis mit den Konversationsdateien (Standard: DATA_DIR)")
+    parser.add_argument("--archive-after-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help="Tage ohne Aktivität bis zur Archivierung")
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                        help="Aufbewahrungsfrist in Tagen (siehe Datenschutzerklärung)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("run", help="Aufbewahrungsfrist durchsetzen und inaktive Konversationen archivieren")
+    subparsers.add_parser("archive", help="Nur inaktive Konversationen archivieren")
+    subparsers.add_parser("retention", help="Nur abgelaufene Konversationen löschen")
+    restore_parser = subparsers.add_parser("restore", help="Konversation eines Benutzers wiederherstellen")
+    restore_parser.add_argument("user_id")
+    args = parser.parse_args()
+
+    manager = ConversationLifecycleManager(
+        args.data_dir,
+        archive_after_days=args.archive_after_days,
+        retention_days=args.retention_days,
+    )
+    if args.command == "run":
+        manager.run()
+    elif args.command == "archive":
+        manager.archive_inactive()
+    elif args.command == "retention":
+        manager.enforce_retention()
+    elif args.command == "restore":
+        if manager.restore(args.user_id) is None:
+            logger.error(f"Keine archivierte Konversation für Benutzer {args.user_id} wiederhergestellt")
+
+
+if __name__ == "__main__":
+    main()
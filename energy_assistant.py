@@ -12,7 +12,9 @@ import os
 import json
 import base64
 import logging
-from datetime import datetime
+import time
+from collections import Counter
+from datetime import datetime, timezone
 from pathlib import Path
 from typing import Dict, List, Optional, Union
 import asyncio
@@ -28,6 +30,15 @@ from telegram.ext import (
     filters,
 )
 
+from conversation_lifecycle import ConversationLifecycleManager
+from prompt_layout import (
+    CHAT_MODEL,
+    PROMPT_LAYOUT,
+    SUMMARY_MAX_QUESTIONS,
+    SUMMARY_QUESTION_CHARS,
+    history_window_start,
+)
+
 # Setze die Standard-Kodierung auf UTF-8
 import sys
 sys.stdout.reconfigure(encoding='utf-8')
@@ -61,6 +72,10 @@ client = OpenAI(
 DATA_DIR = Path(os.getenv("DATA_DIR", "./data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
+# Version des System-Prompts; bei jeder Änderung am Text erhöhen,
+# da sich damit der zwischengespeicherte Präfix ändert
+SYSTEM_PROMPT_VERSION = "1"
+
 # System-Prompt für den Energiespar-Assistenten
 SYSTEM_PROMPT = """
 Du bist ein hilfreicher Assistent, der Benutzer bei der Energieeinsparung unterstützt. Deine Aufgabe ist es:
@@ -122,19 +137,21 @@ class EnergyAssistant:
             max_retries=3
         )
         self.conversation_manager = ConversationManager()
+        self.lifecycle_manager = ConversationLifecycleManager(DATA_DIR)
         self.conversations = {}
-        self.load_conversations()
+        self.usage_totals = Counter()
 
-    def load_conversations(self):
-        """Lädt gespeicherte Konversationen aus dem Datenverzeichnis."""
+    def load_conversation(self, user_id: str) -> Optional[List[Dict]]:
+        """Lädt die gespeicherte Konversation eines Benutzers aus dem Datenverzeichnis."""
+        file_path = DATA_DIR / f"{user_id}.json"
         try:
-            for file_path in DATA_DIR.glob("*.json"):
-                with open(file_path, "r", encoding="utf-8") as file:
-                    user_id = file_path.stem
-                    self.conversations[user_id] = json.load(file)
-            logger.info(f"Konversationen für {len(self.conversations)} Benutzer geladen.")
+            with open(file_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
         except Exception as e:
-            logger.error(f"Fehler beim Laden der Konversationen: {e}")
+            logger.error(f"Fehler beim Laden der Konversation für Benutzer {user_id}: {e}")
+            return None
 
     def save_conversation(self, user_id: str):
         """Speichert die Konversation eines Benutzers."""
@@ -147,17 +164,35 @@ class EnergyAssistant:
             logger.error(f"Fehler beim Speichern der Konversation für Benutzer {user_id}: {e}")
 
     def get_user_conversation(self, user_id: str) -> List[Dict]:
-        """Holt die Konversation eines Benutzers oder erstellt eine neue."""
+        """
+        Holt die Konversation eines Benutzers beim ersten Zugriff aus dem Datenverzeichnis,
+        stellt sie aus dem Archiv wieder her oder erstellt eine neue.
+        """
+        # Fehlt die Datei, wurde die Konversation archiviert oder nach Ablauf der
+        # Aufbewahrungsfrist gelöscht; die Kopie im Speicher ist dann veraltet
+        if user_id in self.conversations and not (DATA_DIR / f"{user_id}.json").exists():
+            del self.conversations[user_id]
         if user_id not in self.conversations:
-            self.conversations[user_id] = [
+            # Die Archivsuche liest synchron nur eine kleine Indexdatei (zwischengespeichert)
+            # und bei einem Treffer ein einzelnes gzip-Mitglied, nicht den gesamten Index
+            conversation = self.load_conversation(user_id) or self.lifecycle_manager.restore(user_id)
+            self.conversations[user_id] = conversation or [
                 {"role": "system", "content": SYSTEM_PROMPT}
             ]
+            if not conversation:
+                # Neue Konversation sofort speichern, damit die Datei ab jetzt existiert
+                self.save_conversation(user_id)
         return self.conversations[user_id]
 
     def add_message_to_conversation(
-        self, user_id: str, role: str, content: str, image_url: Optional[str] = None
+        self,
+        user_id: str,
+        role: str,
+        content: str,
+        image_url: Optional[str] = None,
+        model: Optional[str] = None,
     ):
-        """Fügt eine Nachricht zur Konversation eines Benutzers hinzu."""
+        """Fügt eine Nachricht zur Konversation eines Benutzers hinzu (model: Modell der Antwort)."""
         conversation = self.get_user_conversation(user_id)
         
         message = {"role": role, "content": content}
@@ -171,41 +206,135 @@ class EnergyAssistant:
                     {"type": "image_url", "image_url": {"url": image_url}}
                 ]
             }
+        
+        # Zeitstempel und Modell für die Auswertung (analytics.py); werden nicht an die API geschickt
+        message["timestamp"] = datetime.now(timezone.utc).isoformat()
+        if model:
+            message["model"] = model
             
         conversation.append(message)
         self.save_conversation(user_id)
 
+    @staticmethod
+    def message_text(content: Union[str, List[Dict]]) -> str:
+        """Liefert den Textanteil eines Nachrichteninhalts (Text oder Liste mit Bild)."""
+        if isinstance(content, list):
+            return " ".join(
+                part.get("text", "") for part in content if part.get("type") == "text"
+            )
+        return content or ""
+
+    def build_sliding_messages(self, message: str, user_id: int) -> List[Dict]:
+        """Erstellt die Nachrichtenliste aus System-Prompt und den letzten 20 Nachrichten."""
+        # Lade Konversationsverlauf
+        conversation_history = self.conversation_manager.get_conversation_history(user_id, limit=20)
+        
+        # Erstelle die Nachrichtenliste für die API
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        
+        # Füge den Konversationsverlauf hinzu
+        for msg in conversation_history:
+            if msg.get('type') == 'text':  # Nur Textnachrichten verarbeiten
+                role = "assistant" if msg.get('is_bot', False) else "user"
+                content = msg.get('content', '')
+                if content:  # Nur hinzufügen, wenn Inhalt vorhanden
+                    messages.append({"role": role, "content": content})
+        
+        # Füge die aktuelle Nachricht hinzu
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def build_summary(self, history: List[Dict]) -> str:
+        """Fasst die Fragen aus dem nicht mehr mitgeschickten Verlauf zusammen."""
+        questions = [
+            self.message_text(msg["content"])[:SUMMARY_QUESTION_CHARS]
+            for msg in history if msg["role"] == "user"
+        ]
+        questions = [question for question in questions[-SUMMARY_MAX_QUESTIONS:] if question]
+        if not questions:
+            return ""
+        return "Frühere Fragen des Benutzers in diesem Gespräch:\n" + "\n".join(
+            f"- {question}" for question in questions
+        )
+
+    def build_stable_messages(self, message: str, user_id: int) -> List[Dict]:
+        """
+        Erstellt eine Nachrichtenliste mit byte-stabilem Präfix für das Prompt-Caching.
+
+        Aufbau: System-Prompt, Zusammenfassung des älteren Verlaufs, Verlauf in Blöcken
+        zu HISTORY_BLOCK_SIZE Nachrichten, aktuelle Nachricht. Der Verlauf beginnt immer
+        an einer Blockgrenze, sodass die Anfrage bis zum nächsten Blockwechsel nur
+        am Ende wächst, statt sich mit jeder Nachricht zu verschieben.
+        """
+        conversation = self.get_user_conversation(str(user_id))
+        history = [msg for msg in conversation if msg.get("role") in ("user", "assistant")]
+
+        # Die Handler speichern die aktuelle Nachricht vorab; sie wird (samt Bild) als letzte angehängt
+        current = {"role": "user", "content": message}
+        if history and history[-1]["role"] == "user" and self.message_text(history[-1]["content"]) == message:
+            current = {"role": "user", "content": history.pop()["content"]}
+
+        start = history_window_start(len(history))
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        summary = self.build_summary(history[:start])
+        if summary:
+            messages.append({"role": "system", "content": summary})
+        for msg in history[start:]:
+            content = self.message_text(msg["content"])
+            if content:
+                messages.append({"role": msg["role"], "content": content})
+        messages.append(current)
+        return messages
+
+    def log_usage(self, usage, duration: float):
+        """
+        Protokolliert gecachte und ungecachte Prompt-Token einer Anfrage.
+
+        Die Anfrage wird nicht gestreamt; duration ist daher die Gesamtdauer bis zur
+        vollständigen Antwort, nicht die Zeit bis zum ersten Token.
+        """
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", None) or 0
+
+        self.usage_totals["requests"] += 1
+        self.usage_totals["prompt_tokens"] += prompt_tokens
+        self.usage_totals["cached_tokens"] += cached_tokens
+        self.usage_totals["completion_tokens"] += usage.completion_tokens or 0
+        cache_rate = self.usage_totals["cached_tokens"] / max(1, self.usage_totals["prompt_tokens"])
+
+        logger.info(
+            f"Token-Nutzung ({PROMPT_LAYOUT}, Prompt v{SYSTEM_PROMPT_VERSION}): "
+            f"{prompt_tokens} Prompt-Token, davon {cached_tokens} gecacht und "
+            f"{prompt_tokens - cached_tokens} ungecacht, {usage.completion_tokens} Antwort-Token, "
+            f"Gesamtdauer {duration:.2f}s. Cache-Anteil gesamt: {cache_rate:.1%}"
+        )
+
     async def process_message(self, message: str, user_id: int) -> str:
         """Verarbeitet eine Nachricht und generiert eine Antwort"""
         try:
-            # Lade Konversationsverlauf
-            conversation_history = self.conversation_manager.get_conversation_history(user_id, limit=20)
-            
             # Erstelle die Nachrichtenliste für die API
-            messages = [{"role": "system", "content": SYSTEM_PROMPT}]
-            
-            # Füge den Konversationsverlauf hinzu
-            for msg in conversation_history:
-                if msg.get('type') == 'text':  # Nur Textnachrichten verarbeiten
-                    role = "assistant" if msg.get('is_bot', False) else "user"
-                    content = msg.get('content', '')
-                    if content:  # Nur hinzufügen, wenn Inhalt vorhanden
-                        messages.append({"role": role, "content": content})
-            
-            # Füge die aktuelle Nachricht hinzu
-            messages.append({"role": "user", "content": message})
+            if PROMPT_LAYOUT == "stable":
+                messages = self.build_stable_messages(message, user_id)
+            else:
+                messages = self.build_sliding_messages(message, user_id)
             
             # Erstelle Chat-Completion mit await
             try:
+                started = time.monotonic()
                 completion = await asyncio.get_event_loop().run_in_executor(
                     None,
                     lambda: self.client.chat.completions.create(
-                        model="gpt-4o-2024-08-06",
+                        model=CHAT_MODEL,
                         messages=messages,
                         temperature=0.7,
                         max_tokens=800
                     )
                 )
+                self.log_usage(completion.usage, time.monotonic() - started)
                 
                 response = completion.choices[0].message.content
                 
@@ -324,14 +453,21 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return
 
         # Aktualisiere die Konversation
-        conversation.append({"role": "user", "content": user_input})
+        conversation.append({
+            "role": "user", "content": user_input, "timestamp": datetime.now(timezone.utc).isoformat()
+        })
         
         try:
             # Generiere Antwort
             response = await assistant.process_message(user_input, user_id)
             
             # Füge die Antwort zur Konversation hinzu
-            conversation.append({"role": "assistant", "content": response})
+            conversation.append({
+                "role": "assistant",
+                "content": response,
+                "model": CHAT_MODEL,
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+            })
             
             # Speichere die aktualisierte Konversation
             assistant.save_conversation(str(user_id))
@@ -380,7 +516,7 @@ async def handle_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     response = await assistant.process_message(transcript, user_id)
     
     # Hinzufügen der Assistentenantwort zur Konversation
-    assistant.add_message_to_conversation(user_id, "assistant", response)
+    assistant.add_message_to_conversation(user_id, "assistant", response, model=CHAT_MODEL)
     
     # Senden der Antwort an den Benutzer
     await update.message.reply_text(response)
@@ -416,7 +552,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     response = await assistant.process_message(caption, user_id)
     
     # Hinzufügen der Assistentenantwort zur Konversation
-    assistant.add_message_to_conversation(user_id, "assistant", response)
+    assistant.add_message_to_conversation(user_id, "assistant", response, model=CHAT_MODEL)
     
     # Senden der Antwort an den Benutzer
     await update.message.reply_text(response)
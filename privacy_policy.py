@@ -1,18 +1,29 @@
+import os
+from dotenv import load_dotenv
+
+# Lade Umgebungsvariablen aus .env
+load_dotenv()
+
+# Aufbewahrungsfrist für Gesprächsverläufe in Tagen nach der letzten Nachricht
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "365"))
+
+
 def get_privacy_policy():
     """
     Gibt die Datenschutzerklärung des Bots zurück.
     """
-    privacy_policy = """
+    privacy_policy = f"""
 📋 Datenschutzerklärung für Enerlytic Bot
 
 1. Datenerhebung und -verwendung
-- Wir speichern Ihre Telegram-ID und Nachrichten temporär zur Verarbeitung Ihrer Anfragen
+- Wir speichern Ihre Telegram-ID und Nachrichten, um Ihre Anfragen zu verarbeiten und den Gesprächskontext zu berücksichtigen (Dauer siehe Abschnitt 2)
 - Die Kommunikation wird über OpenAI verarbeitet
 - Wir verwenden keine Tracking-Tools oder Cookies
 
 2. Datenspeicherung
-- Ihre Nachrichten werden nur für die Dauer der Verarbeitung gespeichert
-- Keine dauerhafte Speicherung von Gesprächsverläufen
+- Gesprächsverläufe werden gespeichert, damit der Bot den Kontext Ihrer Anfragen berücksichtigen kann
+- Nach längerer Inaktivität werden Gesprächsverläufe komprimiert archiviert
+- Spätestens {RETENTION_DAYS} Tage nach Ihrer letzten Nachricht werden Gesprächsverläufe endgültig gelöscht
 - Keine Weitergabe von persönlichen Daten an Dritte
 
 3. OpenAI Integration
@@ -28,6 +39,6 @@ def get_privacy_policy():
 5. Kontakt
 Bei Fragen zum Datenschutz kontaktieren Sie uns bitte über Telegram.
 
-Stand: März 2024
+Stand: Oktober 2026
 """
     return privacy_policy 
\ No newline at end of file
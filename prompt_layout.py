@@ -0,0 +1,57 @@
+"""
+Gemeinsame Einstellungen für den Aufbau der API-Anfragen
+
+Wird von energy_assistant.py (Anfragen) und analytics.py (Token-Schätzung) genutzt,
+damit beide denselben Anfrageaufbau zugrunde legen.
+"""
+
+import os
+from dotenv import load_dotenv
+
+# Lade Umgebungsvariablen aus .env
+load_dotenv()
+
+# Modell für die Chat-Antworten des Assistenten
+CHAT_MODEL = "gpt-4o-2024-08-06"
+
+# Aufbau der API-Anfrage: "sliding" (letzte 20 Nachrichten) oder "stable"
+# (gleichbleibender Präfix für das automatische Prompt-Caching des Anbieters)
+PROMPT_LAYOUTS = ("sliding", "stable")
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "sliding")
+
+
+def _positive_int(name: str, default: str) -> int:
+    """Liest eine positive Ganzzahl aus den Umgebungsvariablen."""
+    value = os.getenv(name, default)
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise ValueError(f"{name} muss eine positive Ganzzahl sein (aktuell: {value!r})")
+    return number
+
+
+HISTORY_BLOCK_SIZE = _positive_int("HISTORY_BLOCK_SIZE", "10")
+HISTORY_MAX_BLOCKS = _positive_int("HISTORY_MAX_BLOCKS", "2")
+
+# Stelle sicher, dass ein bekannter Anfrageaufbau gewählt ist
+if PROMPT_LAYOUT not in PROMPT_LAYOUTS:
+    raise ValueError(
+        f"PROMPT_LAYOUT muss einer von {', '.join(PROMPT_LAYOUTS)} sein (aktuell: {PROMPT_LAYOUT!r})"
+    )
+
+# Zusammenfassung des älteren Verlaufs: Anzahl Fragen und Zeichen pro Frage
+SUMMARY_MAX_QUESTIONS = 20
+SUMMARY_QUESTION_CHARS = 200
+
+
+def history_window_start(history_length: int) -> int:
+    """
+    Liefert den Index der ersten Verlaufsnachricht, die im stabilen Aufbau mitgeschickt wird.
+
+    Der Start liegt immer auf einer Blockgrenze und verschiebt sich nur, wenn der
+    Verlauf einen weiteren Block füllt.
+    """
+    first_block = max(0, history_length // HISTORY_BLOCK_SIZE - HISTORY_MAX_BLOCKS + 1)
+    return first_block * HISTORY_BLOCK_SIZE
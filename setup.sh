@@ -17,6 +17,11 @@ OPENAI_API_KEY=dein_openai_api_key
 
 # Konfiguration
 DATA_DIR=./data
+ARCHIVE_AFTER_DAYS=30
+RETENTION_DAYS=365
+PROMPT_LAYOUT=sliding
+HISTORY_BLOCK_SIZE=10
+HISTORY_MAX_BLOCKS=2
 EOL
 
 # Erstellen des Datenverzeichnisses